@@ -3,19 +3,51 @@
 
 import os
 import sys
-import subprocess
 import time
 import json
 import re # Pour les expressions régulières (parsing filename)
+import unicodedata        # Normalisation des termes de recherche (accents)
+import random             # Pour le jitter des attentes entre tentatives
+import threading          # Pour le préchargement en parallèle
+import queue              # File bornée entre le préchargement et l'interaction
+import concurrent.futures # Pool de threads pour le préchargement
+import asyncio            # Lancement concurrent des calculs d'empreinte (fpcalc)
+import contextvars        # Sortie des tâches asyncio rattachée au bon fichier
+import sqlite3            # Cache persistant des réponses des services web
+import hashlib            # Clés compactes pour le cache
+import functools
+import argparse           # Options de la ligne de commande
+import collections
 import mutagen            # Lire/écrire métadonnées
+import mutagen.id3, mutagen.mp3, mutagen.flac, mutagen.mp4, mutagen.oggvorbis, mutagen.oggopus
 import acoustid           # Utiliser 'acoustid' pour fingerprint/lookup
 import musicbrainzngs     # Pour interagir avec l'API MusicBrainz
 import requests           # Pour télécharger les pochettes
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import urllib.error, urllib.request # Adaptateur de session pour musicbrainzngs
+import io
 import questionary        # Pour l'interface interactive
+from prompt_toolkit import PromptSession # Saisie de texte (dépendance de questionary)
+from prompt_toolkit.key_binding import KeyBindings # Choix de l'action en une touche
 from pathlib import Path  # Pour une manipulation plus facile des chemins de fichiers
-import tempfile           # Pour stocker temporairement la pochette téléchargée
-import shutil             # Pour copier/déplacer la pochette si nécessaire
 import traceback          # Pour afficher les erreurs détaillées si besoin
+try:
+    import orjson         # Sérialisation rapide du cache (optionnel)
+except ImportError:
+    orjson = None
+try:
+    import lxml.etree     # Analyse XML plus rapide des réponses MusicBrainz (optionnel)
+except ImportError:
+    lxml = None
+try:
+    import uvloop         # Boucle asyncio plus rapide pour les calculs d'empreinte (optionnel)
+except ImportError:
+    uvloop = None
+try:
+    from rapidfuzz import fuzz # Proximité nom de fichier / correspondances, en C (optionnel)
+except ImportError:
+    fuzz = None
 
 # --- Configuration ---
 ACOUSTID_API_KEY = os.environ.get('ACOUSTID_API_KEY')
@@ -27,11 +59,47 @@ FPCALC_PATH = None
 AUDIO_EXTENSIONS = {'.mp3', '.flac', '.m4a', '.aac', '.ogg', '.opus'}
 ACOUSTID_DELAY = 1.0 / 3.0
 MUSICBRAINZ_DELAY = 1.1
+COVERART_DELAY = 0.25
+PREFETCH_WORKERS = int(os.environ.get('AUDIOTHEQUE_WORKERS', 3)) # Fichiers préparés en parallèle
+PIPELINE_QUEUE_SIZE = max(1, int(os.environ.get('AUDIOTHEQUE_PREFETCH_DEPTH', 2))) # Éléments en attente entre deux étapes du pipeline
+WRITE_WORKERS = 4 # Écritures de tags simultanées en arrière-plan (fichiers distincts)
+SCAN_WORKERS = 8 # Fichiers vérifiés en parallèle lors du tri initial (déjà tagués / à traiter)
+FINGERPRINT_CONCURRENCY = os.cpu_count() or 2 # Calculs d'empreinte simultanés (limités aux cœurs)
+BACKOFF_MAX_RETRIES = 4 # Tentatives supplémentaires si un service demande de ralentir
+BACKOFF_BASE_DELAY = 1.0
+ACOUSTID_ERROR_TOO_MANY_REQUESTS = 14
+RATE_LIMIT_PENALTY_FACTOR = 2.0 # Intervalle élargi après un refus pour excès de débit...
+RATE_LIMIT_PENALTY_DURATION = 30.0 # ... pendant ce nombre de secondes
+ACOUSTID_LOOKUP_URL = "https://api.acoustid.org/v2/lookup"
+ACOUSTID_META = "recordings releases releasegroups"
+ACOUSTID_BATCH_SIZE = 8 # Empreintes envoyées par requête AcoustID
+ACOUSTID_BATCH_WAIT = 0.2 # Attente max (s) pour compléter un lot
+TEXT_MATCH_CONFIDENT_SCORE = 95 # Score MB à partir duquel le nom de fichier suffit (pas d'empreinte)
+TEXT_MATCH_CONFIDENT_MARGIN = 5 # Écart minimal avec la 2e correspondance
+TEXT_SEARCH_SIMILARITY = 0.85 # Recherche textuelle réutilisée si les jetons du titre sont aussi proches (Jaccard)
+TEXT_SEARCH_SIMILAR_MAX = 50 # Titres récents gardés par artiste pour cette réutilisation
+CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / ".cache")) / "audiotheque"
+CACHE_TTL_ACOUSTID = 30 * 24 * 3600 # Durées de validité du cache (secondes)
+CACHE_TTL_MUSICBRAINZ = 7 * 24 * 3600
+CACHE_TTL_COVERART = 90 * 24 * 3600
+CACHE_TTL_FINGERPRINT = 365 * 24 * 3600 # Empreinte d'un fichier inchangé (chemin, mtime, taille)
+ERROR_LOG_SIZE = 50 # Erreurs inattendues conservées (avec leur trace) pour le rapport final
+COVER_MEMORY_SIZE = 8 # Pochettes gardées en mémoire par release (pistes d'un même album)
+TAGGED_XATTR = 'user.audiotheque.tagged' # Attribut étendu "tags essentiels présents" (2:<mtime_ns>:<taille>)
+# Requête MusicBrainz supplémentaire pour l'année quand aucune sortie du recording n'est datée (désactivée par défaut)
+MUSICBRAINZ_YEAR_FALLBACK = os.environ.get('AUDIOTHEQUE_YEAR_FALLBACK', '0') == '1'
 
 # Tags essentiels à vérifier pour considérer un fichier comme "tagué"
-ESSENTIAL_TAGS_MP3_ID3 = ['TIT2', 'TPE1', 'TALB'] # Titre, Artiste, Album (ID3)
-ESSENTIAL_TAGS_VORBIS = ['title', 'artist', 'album'] # Pour FLAC, OGG (Vorbis Comments)
-ESSENTIAL_TAGS_MP4 = ['©nam', '©ART', '©alb'] # Pour M4A/MP4
+ESSENTIAL_TAGS_MP3_ID3 = frozenset({'TIT2', 'TPE1', 'TALB'}) # Titre, Artiste, Album (ID3)
+ESSENTIAL_TAGS_VORBIS = frozenset({'title', 'artist', 'album'}) # Pour FLAC, OGG (Vorbis Comments)
+ESSENTIAL_TAGS_MP4 = frozenset({'©nam', '©ART', '©alb'}) # Pour M4A/MP4
+SIGNIFICANT_TAGS = ('title', 'artist', 'album', 'year') # Au moins un non vide pour qu'une écriture ait lieu
+
+# Dispatch par extension: chargeur mutagen spécifique (pas de détection du format) et tags à vérifier
+AUDIO_LOADERS = {'.mp3': mutagen.mp3.MP3, '.flac': mutagen.flac.FLAC, '.m4a': mutagen.mp4.MP4, '.aac': mutagen.mp4.MP4,
+                 '.ogg': mutagen.oggvorbis.OggVorbis, '.opus': mutagen.oggopus.OggOpus}
+ESSENTIAL_TAGS = {'.mp3': ESSENTIAL_TAGS_MP3_ID3, '.flac': ESSENTIAL_TAGS_VORBIS, '.ogg': ESSENTIAL_TAGS_VORBIS,
+                  '.opus': ESSENTIAL_TAGS_VORBIS, '.m4a': ESSENTIAL_TAGS_MP4, '.aac': ESSENTIAL_TAGS_MP4}
 
 # --- Initialisation des API ---
 try:
@@ -43,59 +111,356 @@ except Exception as e:
     print(f"Erreur init musicbrainzngs: {e}", file=sys.stderr)
     sys.exit(1)
 
+def _bytes_to_lxml_tree(bytes_or_file):
+    """ Remplace musicbrainzngs.util.bytes_to_elementtree: lxml analyse directement les bytes
+        (sans décodage en str), sans charger de DTD ni accéder au réseau. """
+    data = bytes_or_file if isinstance(bytes_or_file, (bytes, str)) else bytes_or_file.read()
+    if isinstance(data, str): data = data.encode('utf-8')
+    # Un parser par appel (non partageable entre threads); commentaires et PI retirés comme avec ElementTree
+    parser = lxml.etree.XMLParser(resolve_entities=False, no_network=True, load_dtd=False, remove_comments=True, remove_pis=True)
+    return lxml.etree.ElementTree(lxml.etree.fromstring(data, parser))
+
+if lxml: musicbrainzngs.util.bytes_to_elementtree = _bytes_to_lxml_tree
+
+# Session HTTP unique (keep-alive, pool de connexions) pour AcoustID, MusicBrainz et Cover Art Archive
+SESSION = requests.Session()
+SESSION.headers['User-Agent'] = MUSICBRAINZ_USER_AGENT
+_http_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(10, PREFETCH_WORKERS * 2),
+                            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False))
+SESSION.mount("https://", _http_adapter)
+SESSION.mount("http://", _http_adapter)
+
+class _SessionOpener:
+    """ Opener compatible urllib pour musicbrainzngs: ses requêtes passent par SESSION. """
+
+    def open(self, req, data=None, timeout=None):
+        try:
+            response = SESSION.request(req.get_method(), req.full_url, data=data or req.data,
+                                       headers=dict(req.header_items()), timeout=timeout or 30)
+        except requests.exceptions.RequestException as e:
+            raise urllib.error.URLError(e)
+        if response.status_code in (429, 503): MUSICBRAINZ_LIMITER.penalize() # Refus pour excès de débit
+        if response.status_code >= 400: # Laisser musicbrainzngs gérer ses codes d'erreur
+            raise urllib.error.HTTPError(req.full_url, response.status_code, response.reason, response.headers, io.BytesIO(response.content))
+        return io.BytesIO(response.content)
+
+_urllib_build_opener = musicbrainzngs.compat.build_opener
+def _build_musicbrainz_opener(*handlers):
+    """ SESSION pour les requêtes anonymes; urllib si musicbrainzngs ajoute une authentification. """
+    if any(not isinstance(h, urllib.request.HTTPHandler) for h in handlers): return _urllib_build_opener(*handlers)
+    return _SessionOpener()
+musicbrainzngs.compat.build_opener = _build_musicbrainz_opener
+
+# --- Limitation de débit ---
+
+class ServiceThrottledError(Exception):
+    """ Le service distant demande de ralentir (HTTP 429/503 ou quota dépassé). """
+
+class RateLimiter:
+    """ Seau à jetons + sémaphore: au plus `slots` appels simultanés et un appel
+        toutes les `interval` secondes en moyenne (rafales jusqu'à `capacity`). """
+
+    def __init__(self, interval, slots=1, capacity=1):
+        self.interval = interval
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._penalty_until = 0.0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(slots)
+
+    def acquire(self):
+        """ Bloque jusqu'à ce qu'un jeton soit disponible, puis le consomme. """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                interval = self.interval * RATE_LIMIT_PENALTY_FACTOR if now < self._penalty_until else self.interval
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) / interval)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * interval
+            time.sleep(wait)
+
+    def penalize(self):
+        """ Le service a refusé pour excès de débit: plus de rafale, et intervalle élargi
+            (x RATE_LIMIT_PENALTY_FACTOR) pendant RATE_LIMIT_PENALTY_DURATION secondes. """
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0)
+            self._penalty_until = time.monotonic() + RATE_LIMIT_PENALTY_DURATION
+
+    def __enter__(self):
+        self._slots.acquire()
+        try: self.acquire()
+        except BaseException: self._slots.release(); raise
+        return self
+
+    def __exit__(self, *exc_info):
+        self._slots.release()
+        return False
+
+ACOUSTID_LIMITER = RateLimiter(ACOUSTID_DELAY, slots=3)
+MUSICBRAINZ_LIMITER = RateLimiter(MUSICBRAINZ_DELAY, slots=1)
+COVERART_LIMITER = RateLimiter(COVERART_DELAY, slots=2)
+
+def call_with_backoff(limiter, func, *args, **kwargs):
+    """ Appelle func sous le limiteur du service. Si le service demande de ralentir,
+        réessaie avec une attente exponentielle + jitter. """
+    for attempt in range(BACKOFF_MAX_RETRIES + 1):
+        with limiter:
+            try: return func(*args, **kwargs)
+            except ServiceThrottledError:
+                limiter.penalize()
+                if attempt == BACKOFF_MAX_RETRIES: raise
+        delay = BACKOFF_BASE_DELAY * (2 ** attempt)
+        time.sleep(delay + random.uniform(0, delay))
+
+# --- Cache persistant ---
+
+_CACHE_MISS = object()
+
+class ResponseCache:
+    """ Cache SQLite des réponses des services web, partagé entre les threads et les exécutions. """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._disabled = False
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None and not self._disabled:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL") # Lectures non bloquées par les écritures (exécutions simultanées)
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, ts INTEGER)")
+            except (OSError, sqlite3.Error) as e:
+                print(f"AVERTISSEMENT: Cache désactivé ({self.path}): {e}", file=sys.stderr)
+                self._disabled = True
+        return self._conn
+
+    def get(self, key, ttl):
+        """ Valeur en cache si elle a moins de `ttl` secondes, sinon _CACHE_MISS. """
+        with self._lock:
+            conn = self._connect()
+            if conn is None: return _CACHE_MISS
+            try:
+                row = conn.execute("SELECT value, ts FROM cache WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error: return _CACHE_MISS
+        if row is None or time.time() - row[1] > ttl: return _CACHE_MISS
+        return orjson.loads(row[0]) if orjson else json.loads(row[0])
+
+    def set(self, key, value):
+        blob = orjson.dumps(value) if orjson else json.dumps(value).encode('utf-8')
+        with self._lock:
+            conn = self._connect()
+            if conn is None: return
+            try:
+                with conn: conn.execute("INSERT OR REPLACE INTO cache (key, value, ts) VALUES (?, ?, ?)", (key, blob, int(time.time())))
+            except sqlite3.Error as e:
+                print(f"AVERTISSEMENT: Écriture cache échouée: {e}", file=sys.stderr)
+
+RESPONSE_CACHE = ResponseCache(CACHE_DIR / "cache.db")
+
+def cache_key(endpoint, *args):
+    """ Clé compacte (blake2b) pour un appel à `endpoint` avec ces arguments. """
+    digest = hashlib.blake2b(digest_size=16)
+    for arg in (endpoint, *args): digest.update(str(arg).encode('utf-8') + b'\x1f')
+    return digest.hexdigest()
+
+def cached(endpoint, ttl):
+    """ Décorateur: mémorise dans RESPONSE_CACHE les résultats non vides, par (endpoint, arguments).
+        Un résultat trouvé en cache évite la requête et donc l'attente du limiteur de débit. """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = cache_key(endpoint, *args)
+            value = RESPONSE_CACHE.get(key, ttl)
+            if value is not _CACHE_MISS: return value
+            value = func(*args)
+            if value: RESPONSE_CACHE.set(key, value) # Erreurs/absences (None, [], '') non mémorisées
+            return value
+        return wrapper
+    return decorator
+
+# --- Sortie des threads de préchargement ---
+
+_thread_output = threading.local()
+_task_output = contextvars.ContextVar('_task_output', default=None) # Idem pour les tâches asyncio
+
+_stray_output = [] # Sortie des threads d'arrière-plan non rattachée à un fichier
+_stray_output_lock = threading.Lock()
+
+class _ThreadBufferedStream:
+    """ Enveloppe sys.stdout/sys.stderr: ce qu'écrit un thread de préchargement est mis
+        en tampon et rejoué par le thread principal quand le fichier est présenté.
+        Seul le thread principal écrit directement: rien ne s'affiche par-dessus une question en cours. """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text):
+        entries = getattr(_thread_output, 'entries', None)
+        if entries is None: entries = _task_output.get()
+        if entries is None:
+            if threading.current_thread() is threading.main_thread(): return self._stream.write(text)
+            with _stray_output_lock: _stray_output.append((self._stream, text))
+            return len(text)
+        entries.append((self._stream, text))
+        return len(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+def replay_output(entries):
+    """ Réécrit sur les flux d'origine la sortie mise en tampon par un thread
+        (précédée de celle des threads d'arrière-plan, mise de côté entre deux questions). """
+    with _stray_output_lock:
+        stray = _stray_output[:]; _stray_output.clear()
+    for stream, text in stray: stream.write(text)
+    for stream, text in entries: stream.write(text)
+
+# --- Requêtes AcoustID groupées ---
+
+def _acoustid_batch_request(items):
+    """ Une seule requête AcoustID pour plusieurs (durée, empreinte). Retourne une réponse
+        par empreinte, au format de acoustid.lookup. Lève ServiceThrottledError si le quota est dépassé. """
+    data = {'client': ACOUSTID_API_KEY, 'format': 'json', 'meta': ACOUSTID_META}
+    if len(items) == 1:
+        data['duration'], data['fingerprint'] = items[0]
+    else:
+        for index, (duration, fingerprint) in enumerate(items):
+            data[f'duration.{index}'] = duration; data[f'fingerprint.{index}'] = fingerprint
+    response = SESSION.post(ACOUSTID_LOOKUP_URL, data=data, timeout=30)
+    if response.status_code in (429, 503): raise ServiceThrottledError(f"HTTP {response.status_code}")
+    try: payload = response.json()
+    except ValueError: raise acoustid.WebServiceError(f"Réponse non JSON (HTTP {response.status_code})")
+
+    if payload.get('status') != 'ok':
+        error = payload.get('error') or {}
+        if error.get('code') == ACOUSTID_ERROR_TOO_MANY_REQUESTS: raise ServiceThrottledError(error.get('message', 'rate limit'))
+        raise acoustid.WebServiceError(error.get('message', f"HTTP {response.status_code}"))
+    if 'fingerprints' not in payload: return [payload]
+    results_by_index = {int(fp.get('index', 0)): fp.get('results', []) for fp in payload['fingerprints']}
+    return [{'status': 'ok', 'results': results_by_index.get(index, [])} for index in range(len(items))]
+
+class AcoustIDBatcher:
+    """ Regroupe les recherches AcoustID des threads de préchargement: un thread dédié envoie
+        jusqu'à `batch_size` empreintes par requête et renvoie à chaque appelant sa réponse. """
+
+    def __init__(self, batch_size=ACOUSTID_BATCH_SIZE, max_wait=ACOUSTID_BATCH_WAIT):
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._pending = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def lookup(self, duration, fingerprint):
+        """ Réponse AcoustID pour cette empreinte; bloque jusqu'à l'envoi du lot qui la contient. """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="acoustid-batch", daemon=True)
+                self._thread.start()
+        future = concurrent.futures.Future()
+        self._pending.put((duration, fingerprint, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                try: batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty: break
+            try:
+                responses = call_with_backoff(ACOUSTID_LIMITER, _acoustid_batch_request, [(d, fp) for d, fp, _ in batch])
+            except Exception as e:
+                for _, _, future in batch: future.set_exception(e)
+                continue
+            for (_, _, future), response in zip(batch, responses): future.set_result(response)
+
+ACOUSTID_BATCHER = AcoustIDBatcher()
+
 # --- Fonctions Utilitaires ---
 
-def check_existing_metadata(filepath):
-    """ Vérifie si les tags essentiels sont présents et non vides. """
+def open_audio(filepath):
+    """ Ouvre le fichier avec le chargeur mutagen de son extension (une seule fois par fichier),
+        ou par détection du format si ce chargeur échoue (.ogg contenant de l'Opus ou du FLAC).
+        Retourne None en cas d'échec. """
     try:
-        audio = mutagen.File(filepath, easy=False)
-        if not audio:
-            print(f"  AVERTISSEMENT: Impossible d'ouvrir {filepath} avec mutagen.", file=sys.stderr)
-            return False
+        try:
+            audio = AUDIO_LOADERS.get(filepath.suffix.lower(), mutagen.File)(filepath)
+        except mutagen.MutagenError:
+            audio = mutagen.File(filepath)
+    except Exception as e:
+        print(f"ERREUR (open_audio) pour {filepath.name}: {e}", file=sys.stderr)
+        return None
+    if audio is None:
+        print(f"  AVERTISSEMENT: Impossible d'ouvrir {filepath} avec mutagen.", file=sys.stderr)
+        return None
+    return audio
 
-        tags_to_check = []
-        tags_dict = None
+def _tagged_marker(filepath):
+    """ Signature de l'état du fichier (mtime en ns et taille): toute modification invalide le marqueur. """
+    st = os.stat(filepath)
+    return f"2:{st.st_mtime_ns}:{st.st_size}"
 
-        if isinstance(audio, mutagen.mp3.MP3):
-            # print("  Détection: MP3 (ID3)") # Optionnel
-            tags_to_check = ESSENTIAL_TAGS_MP3_ID3
-            tags_dict = audio.tags if audio.tags else audio
-        elif isinstance(audio, (mutagen.flac.FLAC, mutagen.oggvorbis.OggVorbis, mutagen.oggopus.OggOpus)):
-            # print("  Détection: FLAC/OGG (Vorbis)") # Optionnel
-            tags_to_check = ESSENTIAL_TAGS_VORBIS
-            tags_dict = audio
-        elif isinstance(audio, mutagen.mp4.MP4):
-            # print("  Détection: MP4 (M4A/AAC)") # Optionnel
-            tags_to_check = ESSENTIAL_TAGS_MP4
-            tags_dict = audio
-        else:
-            print(f"  AVERTISSEMENT: Format non géré pour vérification tags: {type(audio)}", file=sys.stderr)
+def is_marked_tagged(filepath):
+    """ Vrai si une vérification précédente a trouvé les tags essentiels et que le fichier n'a pas été
+        modifié depuis: mutagen n'a alors pas besoin de l'ouvrir. Le marqueur est lu dans l'attribut
+        étendu TAGGED_XATTR, ou dans RESPONSE_CACHE si le système de fichiers ne les gère pas. """
+    try:
+        marker = _tagged_marker(filepath)
+        try:
+            if os.getxattr(filepath, TAGGED_XATTR).decode('ascii', 'replace') == marker: return True
+        except (OSError, AttributeError): pass # Attribut absent ou non géré (AttributeError hors Linux)
+        return RESPONSE_CACHE.get(cache_key('tagged', os.path.abspath(filepath)), float('inf')) == marker
+    except OSError: return False
+
+def mark_tagged(filepath):
+    """ Enregistre le marqueur "tags essentiels présents" pour l'état actuel du fichier. """
+    try:
+        marker = _tagged_marker(filepath)
+        try:
+            os.setxattr(filepath, TAGGED_XATTR, marker.encode('ascii'))
+            return
+        except (OSError, AttributeError): pass
+        RESPONSE_CACHE.set(cache_key('tagged', os.path.abspath(filepath)), marker)
+    except OSError: pass
+
+# Test "tag non vide" propre à chaque format, choisi une fois par fichier selon l'extension
+def _id3_has_content(frame): return bool(frame is not None and frame.text and frame.text[0]) # Trame ID3 (TIT2...)
+def _list_has_content(values): return bool(values and values[0]) # Liste de chaînes (Vorbis, MP4)
+CONTENT_CHECKERS = {'.mp3': _id3_has_content, '.flac': _list_has_content, '.ogg': _list_has_content,
+                    '.opus': _list_has_content, '.m4a': _list_has_content, '.aac': _list_has_content}
+
+def check_existing_metadata(filepath, audio):
+    """ Vérifie si les tags essentiels sont présents et non vides (fichier déjà ouvert par open_audio). """
+    try:
+        suffix = filepath.suffix.lower()
+        tags_to_check = ESSENTIAL_TAGS.get(suffix)
+        if tags_to_check is None:
+            print(f"  AVERTISSEMENT: Format non géré pour vérification tags: {filepath.suffix}", file=sys.stderr)
             return False
 
+        tags_dict = audio.tags
         if not tags_dict:
-             print("  AVERTISSEMENT: Impossible de trouver le dictionnaire de tags.")
+             # print("  AVERTISSEMENT: Impossible de trouver le dictionnaire de tags.") # Optionnel, fréquent lors du tri initial
              return False
 
-        missing_tags = []
-        for tag_key in tags_to_check:
-            if tag_key not in tags_dict:
-                missing_tags.append(tag_key)
-            else:
-                tag_value = tags_dict[tag_key]
-                has_content = False
-                if isinstance(tag_value, list) and tag_value:
-                    first_item = tag_value[0]
-                    if hasattr(first_item, 'text') and first_item.text and first_item.text[0]: has_content = True
-                    elif hasattr(first_item, 'strings') and first_item.strings and first_item.strings[0]: has_content = True
-                    elif isinstance(first_item, str) and first_item: has_content = True
-                if not has_content:
-                     missing_tags.append(f"{tag_key} (vide)")
+        has_content = CONTENT_CHECKERS[suffix]
+        missing_tags = [tag_key for tag_key in tags_to_check if not has_content(tags_dict.get(tag_key))]
 
         if missing_tags:
             # print(f"  Tags manquants/vides: {', '.join(missing_tags)}.") # Optionnel, peut être verbeux
             return False
 
-        print("  Tags essentiels déjà présents.")
+        # print("  Tags essentiels déjà présents.") # Optionnel, résumé affiché après le tri initial
         return True
 
     except Exception as e:
@@ -104,19 +469,43 @@ def check_existing_metadata(filepath):
         return False # En cas d'erreur, on essaie de traiter
 
 def get_fingerprint(filepath):
-    """ Génère l'empreinte AcoustID et la durée via appel direct à fpcalc. """
+    """ Génère l'empreinte AcoustID et la durée. Le calcul est confié à FINGERPRINTER, qui limite
+        le nombre de calculs simultanés au nombre de cœurs quel que soit le nombre de threads appelants. """
+    return FINGERPRINTER.submit(filepath).result()
+
+def get_fingerprint_chromaprint(filepath):
+    """ Empreinte dans le processus via libchromaprint (et audioread).
+        Retourne None si la bibliothèque est absente ou a échoué (repli sur fpcalc). """
+    if not (acoustid.have_chromaprint and acoustid.have_audioread): return None
+    try:
+        duration, fingerprint = acoustid.fingerprint_file(str(filepath))
+        if isinstance(fingerprint, bytes): fingerprint = fingerprint.decode('ascii')
+        return int(duration), fingerprint
+    except Exception as e:
+        print(f"  AVERTISSEMENT: libchromaprint a échoué pour {filepath.name} ({e}), repli sur fpcalc.", file=sys.stderr)
+        return None
+
+async def get_fingerprint_fpcalc(filepath):
+    """ Génère l'empreinte AcoustID et la durée via appel direct à fpcalc (sous-processus asyncio). """
     fpcalc_exe = f'{FPCALC_PATH}fpcalc' if FPCALC_PATH else 'fpcalc'
-    command = [fpcalc_exe, "-json", str(filepath)]
+    stdout = b''
 
     try:
-        process = subprocess.run(command, capture_output=True, text=True, check=True, encoding='utf-8', errors='replace')
-        result = json.loads(process.stdout)
+        process = await asyncio.create_subprocess_exec(fpcalc_exe, "-json", str(filepath),
+                                                       stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        # Sortie gardée en bytes: orjson la lit directement, sans décodage intermédiaire en str
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            print(f"ERREUR: fpcalc a échoué (Code: {process.returncode}) pour {filepath.name}", file=sys.stderr)
+            # print(f"Stderr: {stderr}", file=sys.stderr) # Décommenter pour voir l'erreur fpcalc
+            return None, None
+        result = orjson.loads(stdout) if orjson else json.loads(stdout)
         duration_str = result.get("duration")
         fingerprint = result.get("fingerprint")
 
         if duration_str is None or fingerprint is None:
              print(f"ERREUR: Sortie JSON fpcalc incomplète pour {filepath.name}", file=sys.stderr)
-             print(f"Sortie reçue: {process.stdout[:200]}...", file=sys.stderr) # Limiter la sortie affichée
+             print(f"Sortie reçue: {stdout[:200].decode('utf-8', 'replace')}...", file=sys.stderr) # Limiter la sortie affichée
              return None, None
 
         duration = int(float(duration_str))
@@ -126,25 +515,63 @@ def get_fingerprint(filepath):
     except FileNotFoundError:
         print(f"ERREUR: Exécutable '{fpcalc_exe}' introuvable.", file=sys.stderr)
         return None, None
-    except subprocess.CalledProcessError as e:
-        print(f"ERREUR: fpcalc a échoué (Code: {e.returncode}) pour {filepath.name}", file=sys.stderr)
-        # print(f"Stderr: {e.stderr}", file=sys.stderr) # Décommenter pour voir l'erreur fpcalc
-        return None, None
-    except json.JSONDecodeError as e:
+    except json.JSONDecodeError as e: # orjson.JSONDecodeError en hérite
          print(f"ERREUR: Analyse JSON fpcalc échouée: {e}", file=sys.stderr)
-         print(f"Sortie reçue: {process.stdout[:200]}...", file=sys.stderr)
+         print(f"Sortie reçue: {stdout[:200].decode('utf-8', 'replace')}...", file=sys.stderr)
          return None, None
     except Exception as e:
         print(f"ERREUR inattendue (get_fingerprint) pour {filepath.name}: {e}", file=sys.stderr)
         return None, None
 
+def fingerprint_cache_key(filepath):
+    """ Clé de cache de l'empreinte: chemin absolu, mtime et taille (None si stat impossible). """
+    try: st = os.stat(filepath)
+    except OSError: return None
+    return cache_key('fingerprint', os.path.abspath(filepath), st.st_mtime_ns, st.st_size)
+
+class FingerprintRunner:
+    """ Boucle asyncio dans un thread dédié qui exécute jusqu'à `concurrency` calculs d'empreinte
+        à la fois: fpcalc via asyncio.create_subprocess_exec, ou libchromaprint dans un thread. """
+
+    def __init__(self, concurrency=FINGERPRINT_CONCURRENCY):
+        self.concurrency = concurrency
+        self._loop = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    def submit(self, filepath):
+        """ Lance le calcul; retourne un concurrent.futures.Future de (durée, empreinte).
+            L'empreinte d'un fichier inchangé depuis une exécution précédente vient de RESPONSE_CACHE. """
+        key = fingerprint_cache_key(filepath)
+        cached_value = RESPONSE_CACHE.get(key, CACHE_TTL_FINGERPRINT) if key else _CACHE_MISS
+        if cached_value is not _CACHE_MISS:
+            future = concurrent.futures.Future()
+            future.set_result(tuple(cached_value))
+            return future
+        with self._lock:
+            if self._loop is None:
+                self._loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="fingerprint", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(self._fingerprint(filepath, key, getattr(_thread_output, 'entries', None)), self._loop)
+
+    async def _fingerprint(self, filepath, key, output_entries):
+        if self._semaphore is None: self._semaphore = asyncio.Semaphore(self.concurrency)
+        _task_output.set(output_entries) # Messages rattachés au fichier de l'appelant (contexte propre à la tâche)
+        async with self._semaphore:
+            result = await asyncio.to_thread(get_fingerprint_chromaprint, filepath) if acoustid.have_chromaprint else None
+            result = result or await get_fingerprint_fpcalc(filepath)
+        if key and result[1]: RESPONSE_CACHE.set(key, list(result))
+        return result
+
+FINGERPRINTER = FingerprintRunner()
+
+@cached('acoustid/lookup', CACHE_TTL_ACOUSTID)
 def lookup_acoustid(duration, fingerprint):
     """ Interroge l'API AcoustID pour obtenir des correspondances MusicBrainz. """
     if not duration or not fingerprint: return None
     try:
         # print("  Interrogation AcoustID...") # Optionnel
-        response = acoustid.lookup(ACOUSTID_API_KEY, fingerprint, duration, meta="recordings releases releasegroups")
-        time.sleep(ACOUSTID_DELAY)
+        response = ACOUSTID_BATCHER.lookup(duration, fingerprint)
         if response and response.get('status') == 'ok' and response.get('results'):
              best_result = response['results'][0] # Simplification: prendre le premier
              # print(f"  Résultat AcoustID trouvé (Score: {best_result.get('score', 0):.2f}).") # Optionnel
@@ -153,9 +580,9 @@ def lookup_acoustid(duration, fingerprint):
              # print(f"  Aucune correspondance AcoustID (Status: {response.get('status')}).") # Optionnel
              return None
     except acoustid.WebServiceError as e:
-        print(f"ERREUR Service AcoustID: {e}", file=sys.stderr); time.sleep(ACOUSTID_DELAY); return None
+        print(f"ERREUR Service AcoustID: {e}", file=sys.stderr); return None
     except Exception as e:
-        print(f"ERREUR inattendue (lookup_acoustid): {e}", file=sys.stderr); time.sleep(ACOUSTID_DELAY); return None
+        print(f"ERREUR inattendue (lookup_acoustid): {e}", file=sys.stderr); return None
 
 def get_best_mbid_from_acoustid(acoustid_result):
     """ Extrait le premier Recording MBID pertinent du résultat AcoustID. """
@@ -168,15 +595,36 @@ def get_best_mbid_from_acoustid(acoustid_result):
     # print("  Aucun Recording ID utilisable dans le résultat AcoustID.") # Optionnel
     return None
 
+def earliest_year(dates):
+    """ Plus petite année (AAAA) parmi des dates MusicBrainz ('' si aucune n'est exploitable). """
+    years = [date_str[:4] for date_str in dates if date_str and len(date_str) >= 4 and date_str[:4].isdigit()]
+    return min(years) if years else ''
+
+@cached('musicbrainz/first-release-year', CACHE_TTL_MUSICBRAINZ)
+def get_first_release_year(mbid):
+    """ Année de première sortie via les release groups des sorties d'un recording ('' si inconnue).
+        Requête supplémentaire, utilisée seulement si MUSICBRAINZ_YEAR_FALLBACK est activé. """
+    try:
+        # print(f"  Requête supp. pour année via release groups: {mbid}") # Optionnel
+        with MUSICBRAINZ_LIMITER:
+            release_list = musicbrainzngs.browse_releases(recording=mbid, includes=['release-groups'])['release-list']
+        return earliest_year(release.get('release-group', {}).get('first-release-date', '') for release in release_list)
+    except musicbrainzngs.WebServiceError as e_rg: pass # Ignorer erreur silencieusement ?
+    except Exception: pass # Ignorer autres erreurs silencieusement ?
+    return ''
+
+@cached('musicbrainz/recording', CACHE_TTL_MUSICBRAINZ)
 def get_metadata_by_mbid(mbid):
     """ Récupère et parse les métadonnées détaillées depuis MusicBrainz via un Recording MBID. """
     print(f"  Interrogation MusicBrainz pour MBID: {mbid}...")
     try:
-        rec_info = musicbrainzngs.get_recording_by_id(
-            mbid,
-            includes=['artists', 'releases', 'release-groups', 'artist-credits']
-        )['recording']
-        time.sleep(MUSICBRAINZ_DELAY)
+        with MUSICBRAINZ_LIMITER:
+            # 'release-groups' n'est pas un include valide pour un recording (InvalidIncludeError):
+            # l'année est lue sur les dates des sorties renvoyées avec 'releases'
+            rec_info = musicbrainzngs.get_recording_by_id(
+                mbid,
+                includes=['artists', 'releases', 'artist-credits']
+            )['recording']
 
         metadata = {'mbid': mbid}
         metadata['title'] = rec_info.get('title', '')
@@ -190,21 +638,11 @@ def get_metadata_by_mbid(mbid):
             release = release_list[0] # Simplification
             metadata['album'] = release.get('title', '')
             metadata['release_id'] = release.get('id', None)
-            date_str = release.get('date', '')
-            year = ''
-            if date_str and len(date_str) >= 4 and date_str[:4].isdigit(): year = date_str[:4]
-
-            if not year and release.get('release-group'):
-                 try:
-                     rg_id = release['release-group']['id']
-                     # print(f"  Requête supp. pour année via RG ID: {rg_id}") # Optionnel
-                     rg_info = musicbrainzngs.get_release_group_by_id(rg_id)['release-group']
-                     time.sleep(MUSICBRAINZ_DELAY)
-                     first_release_date = rg_info.get('first-release-date', '')
-                     if first_release_date and len(first_release_date) >= 4 and first_release_date[:4].isdigit():
-                          year = first_release_date[:4]
-                 except musicbrainzngs.WebServiceError as e_rg: pass # Ignorer erreur silencieusement ?
-                 except Exception: pass # Ignorer autres erreurs silencieusement ?
+            # Année de la sortie retenue pour l'album; sinon la plus ancienne date parmi les autres sorties
+            year = earliest_year([release.get('date', '')]) or earliest_year(rel.get('date', '') for rel in release_list)
+
+            if not year and MUSICBRAINZ_YEAR_FALLBACK:
+                 year = get_first_release_year(mbid)
             metadata['year'] = year
 
         if metadata.get('title') and metadata.get('artist'):
@@ -215,13 +653,76 @@ def get_metadata_by_mbid(mbid):
             return None
 
     except musicbrainzngs.WebServiceError as e:
-        print(f"ERREUR Service MusicBrainz (MBID {mbid}): {e}", file=sys.stderr); time.sleep(MUSICBRAINZ_DELAY); return None
+        print(f"ERREUR Service MusicBrainz (MBID {mbid}): {e}", file=sys.stderr); return None
     except Exception as e:
-        print(f"ERREUR inattendue (get_metadata_by_mbid pour {mbid}): {e}", file=sys.stderr); time.sleep(MUSICBRAINZ_DELAY); return None
+        print(f"ERREUR inattendue (get_metadata_by_mbid pour {mbid}): {e}", file=sys.stderr); return None
+
+def _search_tokens(text):
+    """ Jetons normalisés d'un terme de recherche: minuscules, sans accents ni ponctuation. """
+    text = unicodedata.normalize('NFKD', text.lower())
+    return frozenset(re.findall(r'\w+', ''.join(c for c in text if not unicodedata.combining(c))))
+
+class SimilarSearchCache:
+    """ Résultats des recherches textuelles déjà faites, retrouvés pour un même artiste (jetons normalisés)
+        quand les jetons du titre sont assez proches (indice de Jaccard >= threshold).
+        Un compartiment par artiste, chargé depuis RESPONSE_CACHE et réenregistré à chaque ajout.
+        Chaque entrée a sa propre date (expiration après `ttl`); seules les `max_entries` plus récentes sont gardées. """
+
+    def __init__(self, threshold, ttl, max_entries):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, artist_key):
+        """ Compartiment de l'artiste, sans les entrées expirées. """
+        bucket = self._buckets.get(artist_key)
+        if bucket is None:
+            stored = RESPONSE_CACHE.get(cache_key('musicbrainz/search-similar', artist_key), self.ttl)
+            # Entrées [jetons, résultats, date]; l'ancien format sans date est ignoré
+            bucket = [] if stored is _CACHE_MISS else [(frozenset(entry[0]), entry[1], entry[2]) for entry in stored if len(entry) == 3]
+        oldest = time.time() - self.ttl
+        bucket = self._buckets[artist_key] = [entry for entry in bucket if entry[2] >= oldest]
+        return bucket
+
+    def get(self, artist_guess, title_guess):
+        """ (résultats, même jeu de jetons) d'une recherche proche, ou None. """
+        title_tokens = _search_tokens(title_guess)
+        if not title_tokens: return None
+        with self._lock:
+            for tokens, results, _ in self._bucket(' '.join(sorted(_search_tokens(artist_guess)))):
+                if len(tokens & title_tokens) / len(tokens | title_tokens) >= self.threshold: return results, tokens == title_tokens
+        return None
+
+    def add(self, artist_guess, title_guess, results):
+        title_tokens = _search_tokens(title_guess)
+        if not title_tokens: return
+        artist_key = ' '.join(sorted(_search_tokens(artist_guess)))
+        with self._lock:
+            bucket = self._bucket(artist_key)
+            bucket.append((title_tokens, results, int(time.time())))
+            del bucket[:-self.max_entries]
+            RESPONSE_CACHE.set(cache_key('musicbrainz/search-similar', artist_key), [[sorted(tokens), res, ts] for tokens, res, ts in bucket])
+
+SIMILAR_SEARCHES = SimilarSearchCache(TEXT_SEARCH_SIMILARITY, CACHE_TTL_MUSICBRAINZ, TEXT_SEARCH_SIMILAR_MAX)
 
 def search_musicbrainz_by_text(artist_guess, title_guess):
-    """ Cherche sur MusicBrainz par texte. Retourne une LISTE de dictionnaires de correspondances plausibles. """
-    if not title_guess: return []
+    """ Cherche sur MusicBrainz par texte. Retourne (LISTE de dictionnaires de correspondances plausibles, exact).
+        Une recherche proche déjà faite (même artiste, titre presque identique une fois normalisé) est réutilisée;
+        exact est alors faux si les jetons du titre diffèrent: ces résultats ne valent pas une correspondance sûre. """
+    if not title_guess: return [], True
+    similar = SIMILAR_SEARCHES.get(artist_guess, title_guess)
+    if similar is not None:
+        print("  -> Recherche textuelle proche déjà effectuée, résultats réutilisés.")
+        return similar
+    possible_matches = _search_recordings(artist_guess, title_guess)
+    if possible_matches: SIMILAR_SEARCHES.add(artist_guess, title_guess, possible_matches)
+    return possible_matches, True
+
+@cached('musicbrainz/search-recording', CACHE_TTL_MUSICBRAINZ)
+def _search_recordings(artist_guess, title_guess):
+    """ Requête de recherche MusicBrainz proprement dite (résultats filtrés et triés par score). """
 
     query_parts = []
     safe_title = title_guess.replace('"', '\\"')
@@ -234,14 +735,14 @@ def search_musicbrainz_by_text(artist_guess, title_guess):
     print(f"  Recherche textuelle MusicBrainz: {query}...")
     possible_matches = []
     try:
-        result = musicbrainzngs.search_recordings(query=query, limit=10, includes=['release-groups', 'artist-credits'])
-        time.sleep(MUSICBRAINZ_DELAY)
+        with MUSICBRAINZ_LIMITER:
+            result = musicbrainzngs.search_recordings(query=query, limit=10)
         recordings = result.get('recording-list', [])
         if not recordings: return []
 
         # print(f"  {len(recordings)} résultat(s) brut(s) trouvé(s). Filtrage...") # Optionnel
         for rec in recordings:
-            score = rec.get('score', 0)
+            score = int(rec.get('ext:score', 0))
             mbid = rec.get('id')
             title = rec.get('title', '')
             artist_credits = rec.get('artist-credit', [])
@@ -265,21 +766,38 @@ def search_musicbrainz_by_text(artist_guess, title_guess):
         return possible_matches
 
     except musicbrainzngs.WebServiceError as e:
-        print(f"ERREUR Service MusicBrainz (recherche texte): {e}", file=sys.stderr); time.sleep(MUSICBRAINZ_DELAY); return []
+        print(f"ERREUR Service MusicBrainz (recherche texte): {e}", file=sys.stderr); return []
     except Exception as e:
-        print(f"ERREUR inattendue (search_musicbrainz_by_text): {e}", file=sys.stderr); time.sleep(MUSICBRAINZ_DELAY); return []
+        print(f"ERREUR inattendue (search_musicbrainz_by_text): {e}", file=sys.stderr); return []
+
+# Motifs retirés des noms de fichiers, combinés en une seule expression compilée au chargement
+FILENAME_NOISE_PATTERNS = [
+    r'\[[^\]]+\]$', r'\([^)]*official[^)]*\)', r'\([^)]*lyric[^)]*\)',
+    r'\([^)]*audio[^)]*\)', r'\s*HD$', r'\s*4K$', r'^\d+\s*-\s*',
+    r'\([^)]*visualizer[^)]*\)', r'\([^)]*music video[^)]*\)',
+]
+FILENAME_NOISE_RE = re.compile("|".join(f"(?:{p})" for p in FILENAME_NOISE_PATTERNS), re.IGNORECASE)
+
+def is_confident_text_match(possible_matches):
+    """ Vrai si la meilleure correspondance textuelle est sûre: score élevé et aucune concurrente proche. """
+    if not possible_matches or possible_matches[0]['score'] < TEXT_MATCH_CONFIDENT_SCORE: return False
+    return len(possible_matches) == 1 or possible_matches[1]['score'] < possible_matches[0]['score'] - TEXT_MATCH_CONFIDENT_MARGIN
+
+def rank_matches(possible_matches, artist_guess, title_guess):
+    """ Ordonne les correspondances proposées au choix: score MusicBrainz, puis, à score égal,
+        proximité avec l'artiste et le titre tirés du nom de fichier (rapidfuzz, si installé). """
+    if fuzz is None or len(possible_matches) < 2: return possible_matches
+    query = f"{artist_guess} {title_guess}"
+    return sorted(possible_matches, key=lambda x: (x['score'], fuzz.WRatio(query, f"{x['artist_str']} {x['title']}")), reverse=True)
 
 def parse_filename(filename_stem):
     """ Tente d'extraire Artiste et Titre du nom de fichier (sans extension). """
     # print(f"  Analyse du nom de fichier: '{filename_stem}'") # Optionnel
-    text = filename_stem
-    patterns_to_remove = [
-        r'\[[^\]]+\]$', r'\([^)]*official[^)]*\)', r'\([^)]*lyric[^)]*\)',
-        r'\([^)]*audio[^)]*\)', r'\s*HD$', r'\s*4K$', r'^\d+\s*-\s*',
-        r'\([^)]*visualizer[^)]*\)', r'\([^)]*music video[^)]*\)',
-    ]
-    for pattern in patterns_to_remove:
-        text = re.sub(pattern, '', text, flags=re.IGNORECASE).strip()
+    text = filename_stem.strip()
+    while True: # Une suppression peut en exposer une autre en fin de nom ("Titre HD (Official)")
+        cleaned = FILENAME_NOISE_RE.sub('', text).strip()
+        if cleaned == text: break
+        text = cleaned
 
     parts = text.split(' - ', 1)
     metadata = {'title': '', 'artist': ''}
@@ -294,26 +812,55 @@ def parse_filename(filename_stem):
          return metadata
     return None
 
+def _coverart_request(caa_url, method='GET'):
+    """ Requête Cover Art Archive brute; lève ServiceThrottledError sur 429/503. """
+    response = SESSION.request(method, caa_url, timeout=15, allow_redirects=True, headers={'Accept': 'image/jpeg, image/png'})
+    if response.status_code in (429, 503):
+        response.close()
+        raise ServiceThrottledError(f"HTTP {response.status_code}")
+    return response
+
+_recent_covers = collections.OrderedDict() # release MBID -> (mime, données), COVER_MEMORY_SIZE au plus
+_recent_covers_lock = threading.Lock()
+
 def fetch_cover_art(release_mbid):
-    """ Tente de télécharger la pochette depuis Cover Art Archive. Retourne le chemin temporaire. """
+    """ Tente de télécharger la pochette depuis Cover Art Archive. Retourne (mime, données) en mémoire.
+        Les dernières pochettes téléchargées sont gardées pour les autres pistes de la même release. """
     if not release_mbid: return None
-    caa_url = f"http://coverartarchive.org/release/{release_mbid}/front"
+    with _recent_covers_lock:
+        cover = _recent_covers.get(release_mbid)
+        if cover: _recent_covers.move_to_end(release_mbid)
+    if cover:
+        print("  Pochette déjà téléchargée pour cette release (en mémoire).")
+        return cover
+    cover = _download_cover_art(release_mbid)
+    if cover:
+        with _recent_covers_lock:
+            _recent_covers[release_mbid] = cover
+            while len(_recent_covers) > COVER_MEMORY_SIZE: _recent_covers.popitem(last=False)
+    return cover
+
+def _download_cover_art(release_mbid):
+    """ Téléchargement Cover Art Archive proprement dit (HEAD puis GET, absences mémorisées). """
+    caa_url = f"https://coverartarchive.org/release/{release_mbid}/front"
+    missing_key = cache_key('coverart/missing', release_mbid)
+    if RESPONSE_CACHE.get(missing_key, CACHE_TTL_COVERART) is not _CACHE_MISS:
+        print("  Aucune pochette 'front' (absence déjà constatée, en cache).")
+        return None
     print(f"  Tentative téléchargement pochette: {caa_url}")
     try:
-        response = requests.get(caa_url, stream=True, timeout=15, headers={'User-Agent': MUSICBRAINZ_USER_AGENT, 'Accept': 'image/jpeg, image/png'})
-        time.sleep(COVERART_DELAY)
+        # HEAD d'abord: une absence (404) est connue sans télécharger de corps, puis mémorisée
+        response = call_with_backoff(COVERART_LIMITER, _coverart_request, caa_url, 'HEAD')
+        if response.status_code == 200:
+            response = call_with_backoff(COVERART_LIMITER, _coverart_request, caa_url)
+        elif response.status_code == 404:
+            RESPONSE_CACHE.set(missing_key, True)
         if response.status_code == 200:
             content_type = response.headers.get('Content-Type', 'image/jpeg').lower()
-            suffix = '.jpg'
-            if 'png' in content_type: suffix = '.png'
-            elif 'jpeg' in content_type: suffix = '.jpg'
-
-            # Utiliser NamedTemporaryFile pour garantir un nom unique et nettoyage auto si besoin
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, mode='wb')
-            shutil.copyfileobj(response.raw, temp_file)
-            temp_file.close() # Fermer le fichier pour que update_metadata puisse le lire
-            print(f"  Pochette téléchargée dans {temp_file.name}")
-            return temp_file.name
+            mime = 'image/png' if 'png' in content_type else 'image/jpeg'
+            cover_data = response.content
+            print(f"  Pochette téléchargée ({len(cover_data) // 1024} Ko).")
+            return mime, cover_data
         elif response.status_code == 404: print("  Aucune pochette 'front' trouvée (404).")
         else: print(f"  Aucune pochette trouvée (Status: {response.status_code}).")
         return None
@@ -322,87 +869,388 @@ def fetch_cover_art(release_mbid):
     except Exception as e:
         print(f"ERREUR inattendue (fetch_cover_art): {e}", file=sys.stderr); return None
 
-def update_metadata(filepath, metadata, cover_path):
-    """ Écrit les métadonnées et la pochette dans le fichier audio. """
-    print(f"  Écriture métadonnées pour: {filepath.name}")
+ID3_TEXT_FRAMES = {'title': mutagen.id3.TIT2, 'artist': mutagen.id3.TPE1, 'album': mutagen.id3.TALB,
+                   'year': mutagen.id3.TDRC, 'tracknumber': mutagen.id3.TRCK}
+VORBIS_TEXT_KEYS = {'title': 'title', 'artist': 'artist', 'album': 'album', 'year': 'date', 'tracknumber': 'tracknumber'}
+MP4_TEXT_KEYS = {'title': '©nam', 'artist': '©ART', 'album': '©alb', 'year': '©day'}
+
+def update_metadata(audio, metadata, cover):
+    """ Écrit les métadonnées et la pochette dans le fichier audio déjà ouvert (open_audio),
+        avec l'API propre à chaque format, puis sauvegarde une seule fois. """
+    if audio is None:
+        print("ERREUR: Fichier non ouvert, écriture impossible.", file=sys.stderr)
+        return False
+    filename = os.path.basename(audio.filename)
+    print(f"  Écriture métadonnées pour: {filename}")
     saved_ok = False
-    audio = None
-    audio_full = None
 
     try:
-        # Partie 1: Tags Texte (Easy)
-        audio = mutagen.File(filepath, easy=True)
-        if not audio:
-             print(f"ERREUR: Impossible d'ouvrir {filepath.name} (easy) pour écriture.", file=sys.stderr)
-             return False
-        audio.delete()
-        tag_map = {'title': 'title', 'artist': 'artist', 'album': 'album', 'date': 'year', 'tracknumber': 'tracknumber'}
-        for easy_key, meta_key in tag_map.items():
-             value = metadata.get(meta_key)
-             if value:
-                 try: audio[easy_key] = str(value)
-                 except Exception: pass # Ignorer erreurs sur tags non supportés par easy
-        audio.save()
-        print("  Métadonnées texte sauvegardées (via easy=True).")
+        # Partie 1: Tags Texte
+        values = {key: str(metadata[key]) for key in VORBIS_TEXT_KEYS if metadata.get(key)}
+        if audio.tags is None: audio.add_tags()
+        if isinstance(audio, mutagen.mp3.MP3):
+            for key, value in values.items():
+                frame = ID3_TEXT_FRAMES[key]
+                audio.tags.setall(frame.__name__, [frame(encoding=3, text=[value])])
+        elif isinstance(audio, (mutagen.flac.FLAC, mutagen.oggvorbis.OggVorbis, mutagen.oggopus.OggOpus)):
+            for key, value in values.items(): audio[VORBIS_TEXT_KEYS[key]] = [value]
+        elif isinstance(audio, mutagen.mp4.MP4):
+            for key, value in values.items():
+                if key in MP4_TEXT_KEYS: audio[MP4_TEXT_KEYS[key]] = [value]
+                elif key == 'tracknumber' and value.split('/')[0].isdigit(): audio['trkn'] = [(int(value.split('/')[0]), 0)]
+        else:
+            print(f"ERREUR: Format non géré pour écriture: {type(audio)}", file=sys.stderr)
+            return False
 
-        # Partie 2: Pochette (Non-Easy)
-        if cover_path and os.path.exists(cover_path):
+        # Partie 2: Pochette
+        if cover:
             print("  Ajout/Mise à jour de la pochette...")
-            audio_full = mutagen.File(filepath, easy=False)
-            if not audio_full:
-                print(f"ERREUR: Réouverture {filepath.name} (non-easy) échouée pour pochette.", file=sys.stderr)
-                return True # Succès partiel (texte ok)
-
-            with open(cover_path, 'rb') as f: cover_data = f.read()
-            mime = 'image/jpeg' if cover_path.lower().endswith(('.jpg', '.jpeg')) else 'image/png'
-
-            if isinstance(audio_full, mutagen.id3.ID3):
-                if 'APIC:' in audio_full: del audio_full['APIC:'] # Supprimer anciennes
-                audio_full.tags.add(mutagen.id3.APIC(encoding=3, mime=mime, type=3, desc='Cover', data=cover_data))
-            elif isinstance(audio_full, mutagen.flac.FLAC):
-                audio_full.clear_pictures()
+            mime, cover_data = cover
+
+            if isinstance(audio, mutagen.mp3.MP3):
+                audio.tags.delall('APIC') # Supprimer anciennes
+                audio.tags.add(mutagen.id3.APIC(encoding=3, mime=mime, type=3, desc='Cover', data=cover_data))
+            elif isinstance(audio, mutagen.flac.FLAC):
+                audio.clear_pictures()
                 pic = mutagen.flac.Picture(); pic.data = cover_data; pic.type = 3; pic.mime = mime
-                audio_full.add_picture(pic)
-            elif isinstance(audio_full, mutagen.mp4.MP4):
+                audio.add_picture(pic)
+            elif isinstance(audio, mutagen.mp4.MP4):
                 fmt = mutagen.mp4.MP4Cover.FORMAT_JPEG if mime == 'image/jpeg' else mutagen.mp4.MP4Cover.FORMAT_PNG
-                audio_full['covr'] = [mutagen.mp4.MP4Cover(cover_data, imageformat=fmt)]
-            elif isinstance(audio_full, (mutagen.oggvorbis.OggVorbis, mutagen.oggopus.OggOpus)):
+                audio['covr'] = [mutagen.mp4.MP4Cover(cover_data, imageformat=fmt)]
+            elif isinstance(audio, (mutagen.oggvorbis.OggVorbis, mutagen.oggopus.OggOpus)):
                  import base64
                  encoded_data = base64.b64encode(cover_data).decode('ascii')
                  pic_value=f"data:{mime};base64,{encoded_data}"
-                 if 'metadata_block_picture' in audio_full: del audio_full['metadata_block_picture']
-                 audio_full['metadata_block_picture'] = [pic_value]
-            else:
-                print(f"  AVERTISSEMENT: Ajout pochette non géré pour {type(audio_full)}", file=sys.stderr)
-                return True # Succès partiel
+                 if 'metadata_block_picture' in audio: del audio['metadata_block_picture']
+                 audio['metadata_block_picture'] = [pic_value]
 
-            audio_full.save()
-            print("  Pochette ajoutée/mise à jour.")
-        saved_ok = True # Atteint seulement si tout va bien ou juste texte ok
+        audio.save()
+        print("  Métadonnées sauvegardées.")
+        saved_ok = True
 
     except mutagen.MutagenError as e:
         print(f"ERREUR Mutagen (écriture): {e}", file=sys.stderr)
     except Exception as e:
-        print(f"ERREUR inattendue (update_metadata) pour {filepath.name}: {e}", file=sys.stderr)
+        print(f"ERREUR inattendue (update_metadata) pour {filename}: {e}", file=sys.stderr)
         # traceback.print_exc() # Pour debug
-    finally:
-        # Nettoyage pochette temp dans tous les cas après tentative
-         if cover_path and os.path.exists(cover_path):
-            try: os.remove(cover_path)
-            except OSError: pass # Ignorer erreur si suppression échoue
     return saved_ok
 
+# --- Préchargement (étape non interactive) ---
+
+def filename_suggestion(artist_guess, title_guess):
+    """ Suggestion de dernier recours construite à partir des infos brutes du nom de fichier. """
+    if not (title_guess or artist_guess): return None
+    print("  -> Utilisation des infos brutes du nom de fichier.")
+    return {'title': title_guess, 'artist': artist_guess, 'album': '', 'year': '', 'release_id': None}
+
+def is_file_tagged(filepath):
+    """ Tri initial: vrai si les tags essentiels sont présents (marqueur d'une exécution
+        précédente si le fichier n'a pas changé, sinon lecture par mutagen puis marquage).
+        L'objet mutagen n'est pas conservé: prepare_file rouvre le fichier juste avant son
+        traitement (pas de pochettes en mémoire pour toute la liste, ni de tags périmés). """
+    if is_marked_tagged(filepath): return True
+    audio = open_audio(filepath)
+    if audio is not None and check_existing_metadata(filepath, audio):
+        mark_tagged(filepath)
+        return True
+    return False
+
+def partition_tagged(all_files):
+    """ Vérifie tous les fichiers en parallèle (SCAN_WORKERS threads, les lectures se recouvrent)
+        et retourne (nombre de fichiers déjà tagués, liste ordonnée des fichiers à traiter). """
+    todo = []; total_files = len(all_files)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="scan") as executor:
+        for done, (filepath, tagged) in enumerate(zip(all_files, executor.map(is_file_tagged, all_files)), 1):
+            if not tagged: todo.append(filepath)
+            if done % 100 == 0 or done == total_files:
+                print(f"\r  Vérification des tags: {done}/{total_files}", end='', flush=True)
+    print()
+    return total_files - len(todo), todo
+
+def _lookup_when_fingerprinted(fingerprint_future, output_entries):
+    """ Recherche AcoustID lancée dès que l'empreinte est prête (thread de lookup_executor). """
+    _thread_output.entries = output_entries
+    try:
+        duration, fingerprint = fingerprint_future.result()
+        return lookup_acoustid(duration, fingerprint) if fingerprint else None
+    finally:
+        _thread_output.entries = None
+
+def prepare_file(filepath, lookup_executor=None, fingerprint=True):
+    """ Étape 1 (locale): ouverture et analyse du nom de fichier d'un fichier à traiter.
+        Si le nom ne donne pas "Artiste - Titre", l'empreinte est lancée dès maintenant
+        sur FINGERPRINTER, suivie de la recherche AcoustID sur `lookup_executor`: les recherches
+        de plusieurs fichiers en attente se retrouvent ainsi dans un même lot AcoustID.
+        fingerprint=False: pas d'empreinte (piste d'un dossier dont l'album est déjà choisi). """
+    prepared = {'audio': None, 'suggested_metadata': None, 'source_of_suggestion': "Aucune",
+                'cover': None, 'possible_matches': [], 'artist_guess': '', 'title_guess': '', 'fingerprint': None, 'acoustid': None}
+
+    prepared['audio'] = open_audio(filepath)
+    parsed_info = parse_filename(filepath.stem)
+    prepared['artist_guess'] = parsed_info.get('artist', '') if parsed_info else ''
+    prepared['title_guess'] = parsed_info.get('title', '') if parsed_info else ''
+    if fingerprint and not (prepared['artist_guess'] and prepared['title_guess']):
+        prepared['fingerprint'] = FINGERPRINTER.submit(filepath)
+        if lookup_executor:
+            prepared['acoustid'] = lookup_executor.submit(_lookup_when_fingerprinted, prepared['fingerprint'],
+                                                          getattr(_thread_output, 'entries', None))
+    return prepared
+
+def prefetch_file(filepath, prefetched):
+    """ Étape 2 (réseau), exécutée dans un thread du pool: nom de fichier puis empreinte,
+        requêtes AcoustID/MusicBrainz et pochette, à partir du résultat de prepare_file.
+        Les recherches textuelles à plusieurs résultats sont laissées au choix de l'utilisateur. """
+    suggested_metadata = None
+    source_of_suggestion = "Aucune"
+    artist_guess = prefetched['artist_guess']; title_guess = prefetched['title_guess']
+    fingerprint_future = prefetched.pop('fingerprint'); acoustid_future = prefetched.pop('acoustid')
+    possible_matches = None; exact_search = True
+
+    # 1. Nom de fichier "Artiste - Titre" avec correspondance MB sûre: l'empreinte (coûteuse) est inutile
+    if artist_guess and title_guess:
+        print("-> Recherche via nom de fichier...")
+        possible_matches, exact_search = search_musicbrainz_by_text(artist_guess, title_guess)
+        if exact_search and is_confident_text_match(possible_matches): # Pas sur les résultats d'un titre seulement proche
+            print(f"  -> Correspondance sûre (Score: {possible_matches[0]['score']}), empreinte non nécessaire.")
+            temp_metadata = get_metadata_by_mbid(possible_matches[0]['mbid'])
+            if temp_metadata:
+                suggested_metadata = temp_metadata
+                source_of_suggestion = "MusicBrainz (nom fichier)"
+
+    # 2. Sinon, essayer via empreinte
+    if not suggested_metadata:
+        print("-> Recherche via empreinte digitale...")
+        if acoustid_future: acoustid_result = acoustid_future.result() # Déjà lancée par l'étape 1
+        else:
+            duration, fingerprint = fingerprint_future.result() if fingerprint_future else get_fingerprint(filepath)
+            acoustid_result = lookup_acoustid(duration, fingerprint) if fingerprint else None
+        if acoustid_result:
+            best_mbid_found = get_best_mbid_from_acoustid(acoustid_result)
+            if best_mbid_found:
+                 temp_metadata = get_metadata_by_mbid(best_mbid_found)
+                 if temp_metadata:
+                     suggested_metadata = temp_metadata
+                     source_of_suggestion = "MusicBrainz (empreinte)"
+
+    # 3. Si échec empreinte, recherche texte MB sur le nom de fichier (réutilisée si déjà faite)
+    if not suggested_metadata:
+        print("-> Recherche par empreinte échouée ou incomplète.")
+        print("-> Tentative via nom de fichier...")
+
+        if title_guess or artist_guess:
+            if possible_matches is None:
+                print("  -> Recherche textuelle MusicBrainz avec termes parsés...")
+                possible_matches, exact_search = search_musicbrainz_by_text(artist_guess, title_guess)
+
+            if len(possible_matches) == 1 and exact_search:
+                 print("  -> Une seule correspondance textuelle trouvée, sélectionnée.")
+                 selected_mbid = possible_matches[0]['mbid']
+                 print(f"  -> Récupération des détails pour MBID choisi : {selected_mbid}")
+                 temp_metadata = get_metadata_by_mbid(selected_mbid)
+                 if temp_metadata:
+                     suggested_metadata = temp_metadata
+                     source_of_suggestion = "MusicBrainz (nom fichier)"
+                 else:
+                     print(f"  ERREUR: Impossible de récupérer les détails pour MBID {selected_mbid}. Utilisation nom fichier brut.")
+            elif possible_matches:
+                 # Choix interactif (plusieurs résultats, ou recherche proche): laissé au thread principal
+                 prefetched['possible_matches'] = rank_matches(possible_matches, artist_guess, title_guess)
+                 return prefetched
+
+            if not suggested_metadata:
+                 suggested_metadata = filename_suggestion(artist_guess, title_guess)
+                 if suggested_metadata: source_of_suggestion = "Nom de fichier (brut)"
+
+        else: # Echec parsing nom de fichier
+            print("  -> Analyse du nom de fichier infructueuse.")
+
+    # 3. Tentative pochette si source MB
+    if suggested_metadata and source_of_suggestion.startswith("MusicBrainz"):
+         prefetched['cover'] = fetch_cover_art(suggested_metadata.get('release_id'))
+
+    prefetched['suggested_metadata'] = suggested_metadata
+    prefetched['source_of_suggestion'] = source_of_suggestion
+    return prefetched
+
+def album_track_suggestion(filepath, prepared, album):
+    """ Suggestion pour une piste d'un dossier dont l'album a été validé par l'utilisateur: artiste, album,
+        année et pochette repris de ce choix, titre tiré du nom de fichier. Aucune requête réseau. """
+    prepared.pop('fingerprint', None); prepared.pop('acoustid', None)
+    prepared['suggested_metadata'] = dict(album['metadata'], title=prepared['title_guess'] or filepath.stem)
+    prepared['cover'] = album['cover']; prepared['possible_matches'] = []
+    prepared['source_of_suggestion'] = "Album du dossier"
+    return prepared
+
+def run_buffered(func, *args, output=None):
+    """ Appelle func avec sortie console mise en tampon (rejouée par le thread principal).
+        `output` permet de poursuivre le tampon d'une étape précédente. """
+    _thread_output.entries = entries = [] if output is None else output
+    try:
+        result = func(*args)
+    except Exception as e:
+        e.output = entries
+        raise
+    finally:
+        _thread_output.entries = None
+    result['output'] = entries
+    return result
+
+def _put_until_stopped(stage_queue, item, stop_event):
+    """ Place item dans la file bornée en surveillant la demande d'arrêt. """
+    while not stop_event.is_set():
+        try:
+            stage_queue.put(item, timeout=0.2)
+            return True
+        except queue.Full: pass
+    return False
+
+def _get_until_stopped(stage_queue, stop_event):
+    """ Retire un élément de la file en surveillant la demande d'arrêt (None si arrêt). """
+    while not stop_event.is_set():
+        try:
+            return stage_queue.get(timeout=0.2)
+        except queue.Empty: pass
+    return None
+
+def _stage_prepare(all_files, fingerprint_queue, lookup_executor, album_choices, stop_event):
+    """ Étape 1: travail local dans l'ordre des fichiers; les empreintes (puis leurs recherches
+        AcoustID) tournent en avance sur FINGERPRINTER et lookup_executor, sauf pour les dossiers
+        dont l'album a déjà été choisi (album_choices). """
+    for i, filepath in enumerate(all_files):
+        if stop_event.is_set(): return
+        try:
+            prepared = run_buffered(prepare_file, filepath, lookup_executor, filepath.parent not in album_choices)
+        except Exception as e:
+            prepared = e
+        if not _put_until_stopped(fingerprint_queue, (i, filepath, prepared), stop_event): return
+    _put_until_stopped(fingerprint_queue, None, stop_event)
+
+def _stage_lookup(fingerprint_queue, executor, ui_queue, album_choices, stop_event):
+    """ Étape 2: confie les requêtes réseau au pool (le débit est réglé par les RateLimiter,
+        et les appels simultanés permettent le regroupement AcoustID) et transmet à l'interface.
+        Les pistes d'un dossier dont l'album a été choisi reprennent ce choix sans requête
+        (celles déjà transmises le reprennent dans le thread principal). """
+    while True:
+        item = _get_until_stopped(fingerprint_queue, stop_event)
+        if item is None: break
+        i, filepath, prepared = item
+        if isinstance(prepared, Exception): # Échec de l'étape 1, signalé à l'interface
+            future = concurrent.futures.Future()
+            future.set_exception(prepared)
+        elif filepath.parent in album_choices:
+            future = concurrent.futures.Future()
+            future.set_result(album_track_suggestion(filepath, prepared, album_choices[filepath.parent]))
+        else:
+            future = executor.submit(run_buffered, prefetch_file, filepath, prepared, output=prepared['output'])
+        if not _put_until_stopped(ui_queue, (i, filepath, future), stop_event):
+            future.cancel()
+            return
+    _put_until_stopped(ui_queue, None, stop_event)
+
+def iter_audio_files(root):
+    """ Parcourt `root` avec os.scandir (pile explicite plutôt que des générateurs imbriqués
+        sur toute la profondeur) et ne produit que les fichiers audio (filtre sur le nom,
+        sans stat ni Path pour les autres entrées). """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name[entry.name.rfind('.'):].lower() in AUDIO_EXTENSIONS:
+                        yield Path(entry.path)
+        except OSError as e:
+            if directory is root: raise
+            print(f"  AVERTISSEMENT: Dossier ignoré {directory}: {e}", file=sys.stderr)
+
+def write_metadata_buffered(audio, metadata, cover):
+    """ update_metadata exécuté par un thread d'écriture; retourne (succès, sortie en tampon). """
+    _thread_output.entries = entries = []
+    try:
+        return update_metadata(audio, metadata, cover), entries
+    finally:
+        _thread_output.entries = None
+
+def finish_write(pending_write):
+    """ Attend une écriture en arrière-plan et rejoue sa sortie. Vrai si elle a réussi
+        (le fichier est alors marqué comme tagué si les tags essentiels ont été écrits). """
+    filepath, metadata, write_future = pending_write
+    written, output = write_future.result()
+    replay_output(output)
+    if written and all(metadata.get(k) for k in ['title', 'artist', 'album']): mark_tagged(filepath)
+    return written
+
+# --- Saisie interactive ---
+
+_text_session = None
+
+def ptext(message, default=''):
+    """ Saisie de texte pré-remplie. Une seule PromptSession sert à toutes les saisies
+        (questionary.text en recrée une à chaque question); son historique est partagé. """
+    global _text_session
+    if _text_session is None: _text_session = PromptSession()
+    return _text_session.prompt(f"{message} ", default=default or '')
+
+TAG_LABELS = {'title': "Titre", 'artist': "Artiste", 'album': "Album", 'year': "Année"} # Tags saisis, dans l'ordre
+
+def edit_tags(defaults):
+    """ Saisie des tags de TAG_LABELS, pré-remplie avec `defaults`. """
+    return {key: ptext(f"{label}:", defaults.get(key, '')) for key, label in TAG_LABELS.items()}
+
+ACTION_KEYS = {'a': 'accept', 'm': 'modify', 's': 'manual', 'k': 'skip', 'q': 'stop'} # Touche -> action
+ACTION_LABELS = {'accept': "✅ Accepter", 'modify': "✏️ Modifier", 'manual': "✍️ Saisir manuellement",
+                 'skip': "➡️ Passer", 'stop': "🛑 Arrêter"}
+
+_action_session = None
+
+def ask_action(message, actions):
+    """ Choix de l'action en une seule touche (ACTION_KEYS) parmi `actions`, sans menu à parcourir.
+        Entrée choisit la première action proposée, les autres touches sont ignorées. """
+    global _action_session
+    if _action_session is None: _action_session = PromptSession() # Distincte de ptext: les raccourcis lui restent attachés
+    bindings = KeyBindings()
+    @bindings.add('<any>')
+    def _ignore(event): pass
+    @bindings.add('c-c')
+    def _interrupt(event): event.app.exit(exception=KeyboardInterrupt, style='class:aborting')
+    @bindings.add('enter')
+    def _default(event): event.app.exit(result=actions[0])
+    for key, action in ACTION_KEYS.items():
+        if action in actions: bindings.add(key)(lambda event, action=action: event.app.exit(result=action))
+    keys_help = "  ".join(f"[{key}] {ACTION_LABELS[action]}" for key, action in ACTION_KEYS.items() if action in actions)
+    return _action_session.prompt(f"{message}\n  {keys_help}\n> ", key_bindings=bindings)
+
+def handle_accept(suggested_metadata, suggested_cover):
+    return suggested_metadata, suggested_cover
+
+def handle_modify(suggested_metadata, suggested_cover):
+    print("\n--- Modification ---")
+    modified_metadata = edit_tags(suggested_metadata)
+    keep_cover = suggested_cover and questionary.confirm("Conserver la pochette suggérée ?", default=True).ask()
+    return modified_metadata, suggested_cover if keep_cover else None
+
+def handle_manual(suggested_metadata, suggested_cover):
+    print("\n--- Saisie Manuelle ---")
+    return edit_tags(suggested_metadata or {}), None # Pré-rempli avec la suggestion éventuelle; pas de pochette en manuel pour l'instant
+
+# Actions produisant des métadonnées à écrire: (métadonnées, pochette) = handler(suggestion, pochette suggérée)
+ACTION_HANDLERS = {'accept': handle_accept, 'modify': handle_modify, 'manual': handle_manual}
+
 # --- Fonction Principale ---
 def process_music_library(music_dir):
     print(f"Scan interactif du dossier : {music_dir}")
     file_count = 0; processed_count = 0; skipped_count = 0; error_count = 0; tagged_count = 0
     stop_processing = False
 
-    # Pas besoin de TemporaryDirectory global si NamedTemporaryFile est utilisé et nettoyé dans update_metadata
-    # with tempfile.TemporaryDirectory() as temp_dir: ...
-
     try:
-        all_files = sorted([p for p in music_dir.rglob('*') if p.is_file() and p.suffix.lower() in AUDIO_EXTENSIONS])
+        all_files = []
+        for filepath in iter_audio_files(music_dir): # Compteur affiché pendant le parcours des grandes bibliothèques
+            all_files.append(filepath)
+            if len(all_files) % 1000 == 0: print(f"\r  {len(all_files)} fichiers audio trouvés...", end='', flush=True)
+        if len(all_files) >= 1000: print()
+        all_files.sort()
         total_files = len(all_files)
         print(f"Trouvé {total_files} fichiers audio à vérifier.")
         if total_files == 0:
@@ -416,213 +1264,179 @@ def process_music_library(music_dir):
         print(f"ERREUR lors du listage des fichiers: {e}", file=sys.stderr)
         return
 
+    # Tri initial en parallèle: seuls les fichiers à traiter passent dans le pipeline interactif
+    tagged_count, todo_files = partition_tagged(all_files)
+    print(f"{tagged_count} fichier(s) sur {total_files} déjà tagué(s), {len(todo_files)} à traiter.")
+
+    # Pipeline en trois étapes reliées par des files bornées: préparation locale et empreintes
+    # (étape 1) -> requêtes réseau (étape 2, pool de PREFETCH_WORKERS threads) -> interaction
+    # (étape 3, thread principal). Les fichiers suivants avancent pendant que l'utilisateur répond.
+    stop_event = threading.Event()
+    fingerprint_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    ui_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+    # Recherches AcoustID anticipées: assez de threads pour remplir un lot ACOUSTID_BATCH_SIZE
+    lookup_executor = concurrent.futures.ThreadPoolExecutor(max_workers=ACOUSTID_BATCH_SIZE, thread_name_prefix="acoustid")
+    # Écritures des tags en arrière-plan pendant que l'utilisateur passe au fichier suivant
+    # (WRITE_WORKERS threads; bilans et sorties rejoués dans l'ordre de soumission)
+    writer = concurrent.futures.ThreadPoolExecutor(max_workers=WRITE_WORKERS, thread_name_prefix="writer")
+    pending_writes = collections.deque() # (fichier, métadonnées, future) dans l'ordre de soumission
+    # Album validé par dossier (métadonnées communes et pochette), proposé aux autres pistes du dossier
+    album_choices = {}; album_asked = set()
+    tracks_left = collections.Counter(filepath.parent for filepath in todo_files)
+    errors_log = collections.deque(maxlen=ERROR_LOG_SIZE) # (fichier, erreur, trace): affichées au rapport final
+    continue_on_error = None # Réponse « à tous » après une erreur: plus de question pour les suivantes
+    stages = [threading.Thread(target=_stage_prepare, args=(todo_files, fingerprint_queue, lookup_executor, album_choices, stop_event), name="prepare", daemon=True),
+              threading.Thread(target=_stage_lookup, args=(fingerprint_queue, executor, ui_queue, album_choices, stop_event), name="lookup", daemon=True)]
+    original_stdout, original_stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = _ThreadBufferedStream(original_stdout), _ThreadBufferedStream(original_stderr)
+    for stage in stages: stage.start()
 
-    for i, filepath in enumerate(all_files):
-        if stop_processing: break
-        print(f"\n--- Fichier {i+1}/{total_files}: {filepath.relative_to(music_dir)} ---")
-
-        try:
-            if check_existing_metadata(filepath):
-                tagged_count += 1
-                continue
-
-            # --- Logique de recherche v1.4 ---
-            suggested_metadata = None
-            source_of_suggestion = "Aucune"
-            suggested_cover_path = None
-            cover_temp_file = None
-            best_mbid_found = None
-            action = None # Action utilisateur
-
-            # 1. Essayer via empreinte
-            print("-> Recherche via empreinte digitale...")
-            duration, fingerprint = get_fingerprint(filepath)
-            if fingerprint:
-                acoustid_result = lookup_acoustid(duration, fingerprint)
-                if acoustid_result:
-                    best_mbid_found = get_best_mbid_from_acoustid(acoustid_result)
-                    if best_mbid_found:
-                         temp_metadata = get_metadata_by_mbid(best_mbid_found)
+    try:
+        while not stop_processing:
+            item = ui_queue.get()
+            if item is None: break
+            i, filepath, future = item
+            tracks_left[filepath.parent] -= 1
+            while pending_writes and pending_writes[0][2].done(): # Bilan des écritures terminées
+                if finish_write(pending_writes.popleft()): processed_count += 1
+                else: error_count += 1
+            print(f"\n--- Fichier {i+1}/{len(todo_files)}: {filepath.relative_to(music_dir)} ---")
+
+            try:
+                try:
+                    prefetched = future.result()
+                except Exception as prefetch_error:
+                    replay_output(getattr(prefetch_error, 'output', []))
+                    raise
+                replay_output(prefetched['output'])
+                # Album choisi pendant que cette piste était déjà préparée: le choix l'emporte
+                if filepath.parent in album_choices and prefetched['source_of_suggestion'] != "Album du dossier":
+                    prefetched = album_track_suggestion(filepath, prefetched, album_choices[filepath.parent])
+
+                # --- Logique de recherche v1.4 ---
+                suggested_metadata = prefetched['suggested_metadata']
+                source_of_suggestion = prefetched['source_of_suggestion']
+                suggested_cover = prefetched['cover']
+                possible_matches = prefetched['possible_matches']
+                artist_guess = prefetched['artist_guess']
+                title_guess = prefetched['title_guess']
+                action = None # Action utilisateur
+
+                # Plusieurs correspondances textuelles: choix de l'utilisateur
+                if possible_matches:
+                     selected_mbid = None
+                     print(f"  -> {len(possible_matches)} correspondances textuelles trouvées. Veuillez choisir :")
+                     choices = []
+                     for match in possible_matches:
+                          display_text = f"{match['title']} - {match['artist_str']}"
+                          if match.get('album_hint'): display_text += f" ({match['album_hint']})"
+                          if match.get('year_hint'): display_text += f" [{match['year_hint']}]"
+                          display_text += f" (Score: {match['score']})"
+                          choices.append(questionary.Choice(title=display_text, value=match['mbid']))
+                     choices.append(questionary.Separator())
+                     choices.append(questionary.Choice("Aucune de ces propositions (utiliser nom fichier brut)", value="fallback_filename"))
+                     choices.append(questionary.Choice("Aucune de ces propositions (saisie manuelle)", value="manual"))
+                     choices.append(questionary.Choice("Passer ce fichier (Skip)", value="skip"))
+                     choices.append(questionary.Choice("Arrêter le script", value="stop"))
+
+                     user_choice = questionary.select("Quelle est la bonne correspondance ?", choices=choices).ask()
+
+                     if user_choice == "fallback_filename": source_of_suggestion = "Nom de fichier (brut)"
+                     elif user_choice == "manual": action = "manual"; source_of_suggestion = "Manuel"
+                     elif user_choice == "skip": action = "skip"
+                     elif user_choice == "stop" or user_choice is None: action = "stop"
+                     else: selected_mbid = user_choice; source_of_suggestion = "MusicBrainz (choix utilisateur)" # Provisoire
+
+                     # Récupérer détails si un MBID a été choisi
+                     if selected_mbid:
+                         print(f"  -> Récupération des détails pour MBID choisi : {selected_mbid}")
+                         temp_metadata = get_metadata_by_mbid(selected_mbid)
                          if temp_metadata:
                              suggested_metadata = temp_metadata
-                             source_of_suggestion = "MusicBrainz (empreinte)"
-                         else: best_mbid_found = None
-
-            # 2. Si échec empreinte, essayer via nom de fichier -> Recherche Texte MB
-            if not suggested_metadata:
-                print("-> Recherche par empreinte échouée ou incomplète.")
-                print("-> Tentative via nom de fichier...")
-                parsed_info = parse_filename(filepath.stem)
-
-                if parsed_info and (parsed_info.get('title') or parsed_info.get('artist')):
-                    artist_guess = parsed_info.get('artist', '')
-                    title_guess = parsed_info.get('title', '')
-                    print("  -> Recherche textuelle MusicBrainz avec termes parsés...")
-                    possible_matches = search_musicbrainz_by_text(artist_guess, title_guess)
-                    selected_mbid = None
-
-                    if len(possible_matches) == 1:
-                         print("  -> Une seule correspondance textuelle trouvée, sélectionnée.")
-                         selected_mbid = possible_matches[0]['mbid']
-                         source_of_suggestion = "MusicBrainz (nom fichier)" # Provisoire
-
-                    elif len(possible_matches) > 1:
-                         print(f"  -> {len(possible_matches)} correspondances textuelles trouvées. Veuillez choisir :")
-                         choices = []
-                         for match in possible_matches:
-                              display_text = f"{match['title']} - {match['artist_str']}"
-                              if match.get('album_hint'): display_text += f" ({match['album_hint']})"
-                              if match.get('year_hint'): display_text += f" [{match['year_hint']}]"
-                              display_text += f" (Score: {match['score']})"
-                              choices.append(questionary.Choice(title=display_text, value=match['mbid']))
-                         choices.append(questionary.Separator())
-                         choices.append(questionary.Choice("Aucune de ces propositions (utiliser nom fichier brut)", value="fallback_filename"))
-                         choices.append(questionary.Choice("Aucune de ces propositions (saisie manuelle)", value="manual"))
-                         choices.append(questionary.Choice("Passer ce fichier (Skip)", value="skip"))
-                         choices.append(questionary.Choice("Arrêter le script", value="stop"))
-
-                         user_choice = questionary.select("Quelle est la bonne correspondance ?", choices=choices).ask()
-
-                         if user_choice == "fallback_filename": source_of_suggestion = "Nom de fichier (brut)"
-                         elif user_choice == "manual": action = "manual"; source_of_suggestion = "Manuel"
-                         elif user_choice == "skip": action = "skip"
-                         elif user_choice == "stop" or user_choice is None: action = "stop"
-                         else: selected_mbid = user_choice; source_of_suggestion = "MusicBrainz (choix utilisateur)" # Provisoire
-
-                    # Récupérer détails si un MBID a été choisi/trouvé
-                    if selected_mbid:
-                        print(f"  -> Récupération des détails pour MBID choisi : {selected_mbid}")
-                        temp_metadata = get_metadata_by_mbid(selected_mbid)
-                        if temp_metadata:
-                            suggested_metadata = temp_metadata
-                            best_mbid_found = selected_mbid # Confirmer l'ID utilisé
-                            # La source a été mise à jour lors du choix ou si len==1
-                        else:
-                            print(f"  ERREUR: Impossible de récupérer les détails pour MBID {selected_mbid}. Utilisation nom fichier brut.")
-                            source_of_suggestion = "Nom de fichier (brut)"
-                            best_mbid_found = None # Pas d'ID fiable finalement
-
-                    # Si recherche texte vide OU fallback choisi OU erreur récupération détails MBID
-                    if not suggested_metadata and source_of_suggestion != "Manuel" and action not in ["skip", "stop"]:
-                         if title_guess or artist_guess: # Vérifier qu'on a qqc à proposer
-                              print("  -> Utilisation des infos brutes du nom de fichier.")
-                              suggested_metadata = {'title': title_guess, 'artist': artist_guess,'album': '','year': '','release_id': None}
-                              source_of_suggestion = "Nom de fichier (brut)"
-                              best_mbid_found = None
-                         else: # Rien trouvé nulle part
-                               source_of_suggestion = "Aucune"
-
-                else: # Echec parsing nom de fichier
-                    print("  -> Analyse du nom de fichier infructueuse.")
-                    source_of_suggestion = "Aucune"
-
-            # 4. Tentative pochette si source MB
-            if suggested_metadata and source_of_suggestion.startswith("MusicBrainz"):
-                 release_id = suggested_metadata.get('release_id')
-                 if release_id:
-                      cover_temp_file = fetch_cover_art(release_id)
-                      if cover_temp_file: suggested_cover_path = cover_temp_file
-
-            # --- Interaction Utilisateur (choix final) ---
-            final_metadata = None
-            current_cover_to_use = None
-
-            if action in ["manual", "skip", "stop"]: pass # Action déjà déterminée
-            elif suggested_metadata and source_of_suggestion != "Aucune":
-                 print(f"\n--- Suggestion Finale (Source: {source_of_suggestion}) ---")
-                 print(f"  Titre:   {suggested_metadata.get('title', 'N/A')}")
-                 print(f"  Artiste: {suggested_metadata.get('artist', 'N/A')}")
-                 if suggested_metadata.get('album'): print(f"  Album:   {suggested_metadata.get('album')}")
-                 if suggested_metadata.get('year'): print(f"  Année:   {suggested_metadata.get('year')}")
-                 if suggested_cover_path: print(f"  Pochette: Trouvée")
-                 elif source_of_suggestion.startswith("MusicBrainz"): print("  Pochette: Non trouvée ou pas cherchée")
-                 print("------------------------------------")
-                 action = questionary.select(
-                    "Action pour cette suggestion ?",
-                    choices=[
-                        questionary.Choice("✅ Accepter", value="accept"),
-                        questionary.Choice("✏️ Modifier", value="modify"),
-                        questionary.Choice("✍️ Saisir Manuellement", value="manual"),
-                        questionary.Choice("➡️ Passer (Skip)", value="skip"),
-                        questionary.Choice("🛑 Arrêter", value="stop"),
-                    ], use_shortcuts=True ).ask()
-            else:
-                 print("\n--- Aucune suggestion finale ---")
-                 action = questionary.select(
-                    "Action pour ce fichier ?",
-                    choices=[
-                        questionary.Choice("✍️ Saisir Manuellement", value="manual"),
-                        questionary.Choice("➡️ Passer (Skip)", value="skip"),
-                        questionary.Choice("🛑 Arrêter", value="stop"),
-                    ], use_shortcuts=True ).ask()
-
-            # --- Traitement Action ---
-            if action == "accept":
-                final_metadata = suggested_metadata
-                current_cover_to_use = suggested_cover_path
-            elif action == "modify":
-                modified_metadata = {}
-                print("\n--- Modification ---")
-                modified_metadata['title'] = questionary.text("Titre:", default=suggested_metadata.get('title', '')).ask()
-                modified_metadata['artist'] = questionary.text("Artiste:", default=suggested_metadata.get('artist', '')).ask()
-                modified_metadata['album'] = questionary.text("Album:", default=suggested_metadata.get('album', '')).ask()
-                modified_metadata['year'] = questionary.text("Année:", default=suggested_metadata.get('year', '')).ask()
-                if suggested_cover_path:
-                     keep_cover = questionary.confirm("Conserver la pochette suggérée ?", default=True).ask()
-                     current_cover_to_use = suggested_cover_path if keep_cover else None
-                else: current_cover_to_use = None
-                final_metadata = modified_metadata
-            elif action == "manual":
-                manual_metadata = {}
-                print("\n--- Saisie Manuelle ---")
-                manual_metadata['title'] = questionary.text("Titre:", default=suggested_metadata.get('title', '') if suggested_metadata else '').ask() # Pré-remplir ?
-                manual_metadata['artist'] = questionary.text("Artiste:", default=suggested_metadata.get('artist', '') if suggested_metadata else '').ask()
-                manual_metadata['album'] = questionary.text("Album:", default=suggested_metadata.get('album', '') if suggested_metadata else '').ask()
-                manual_metadata['year'] = questionary.text("Année:", default=suggested_metadata.get('year', '') if suggested_metadata else '').ask()
-                final_metadata = manual_metadata
-                current_cover_to_use = None # Pas de pochette en manuel pour l'instant
-            elif action == "skip": skipped_count += 1
-            elif action == "stop" or action is None: stop_processing = True
-            else: skipped_count += 1 # Cas par défaut
-
-            # Nettoyer pochette temp si téléchargée mais non utilisée
-            if suggested_cover_path and current_cover_to_use != suggested_cover_path and os.path.exists(suggested_cover_path):
-                 print("  Nettoyage de la pochette suggérée non utilisée...")
-                 try: os.remove(suggested_cover_path)
-                 except OSError: pass
-
-            # --- Écriture des métadonnées ---
-            if final_metadata and action not in ["skip", "stop", None]:
-                if any(final_metadata.get(k) for k in ['title', 'artist', 'album', 'year']):
-                    print("  Application des métadonnées...")
-                    if update_metadata(filepath, final_metadata, current_cover_to_use):
-                         processed_count += 1
-                    else:
-                         error_count += 1
+                             suggested_cover = fetch_cover_art(temp_metadata.get('release_id'))
+                         else:
+                             print(f"  ERREUR: Impossible de récupérer les détails pour MBID {selected_mbid}. Utilisation nom fichier brut.")
+                             source_of_suggestion = "Nom de fichier (brut)"
+
+                     # Fallback choisi OU erreur récupération détails MBID
+                     if not suggested_metadata and source_of_suggestion != "Manuel" and action not in ["skip", "stop"]:
+                          suggested_metadata = filename_suggestion(artist_guess, title_guess)
+                          source_of_suggestion = "Nom de fichier (brut)" if suggested_metadata else "Aucune"
+
+                # --- Interaction Utilisateur (choix final) ---
+                final_metadata = None
+                current_cover_to_use = None
+
+                if action in ["manual", "skip", "stop"]: pass # Action déjà déterminée
+                elif suggested_metadata and source_of_suggestion != "Aucune":
+                     print(f"\n--- Suggestion Finale (Source: {source_of_suggestion}) ---")
+                     print(f"  Titre:   {suggested_metadata.get('title', 'N/A')}")
+                     print(f"  Artiste: {suggested_metadata.get('artist', 'N/A')}")
+                     if suggested_metadata.get('album'): print(f"  Album:   {suggested_metadata.get('album')}")
+                     if suggested_metadata.get('year'): print(f"  Année:   {suggested_metadata.get('year')}")
+                     if suggested_cover: print(f"  Pochette: Trouvée")
+                     elif source_of_suggestion.startswith("MusicBrainz"): print("  Pochette: Non trouvée ou pas cherchée")
+                     print("------------------------------------")
+                     action = ask_action("Action pour cette suggestion ?", ['accept', 'modify', 'manual', 'skip', 'stop'])
                 else:
-                     print("  Aucune donnée significative à écrire fournie. Fichier passé.")
+                     print("\n--- Aucune suggestion finale ---")
+                     action = ask_action("Action pour ce fichier ?", ['manual', 'skip', 'stop'])
+
+                # --- Traitement Action ---
+                action_handler = ACTION_HANDLERS.get(action)
+                if action_handler: final_metadata, current_cover_to_use = action_handler(suggested_metadata, suggested_cover)
+                elif action == "skip": skipped_count += 1
+                elif action == "stop" or action is None: stop_processing = True
+                else: skipped_count += 1 # Cas par défaut
+
+                # --- Écriture des métadonnées ---
+                if final_metadata and action not in ["skip", "stop", None]:
+                    if any(map(final_metadata.get, SIGNIFICANT_TAGS)):
+                        print("  Application des métadonnées...")
+                        pending_writes.append((filepath, final_metadata,
+                                               writer.submit(write_metadata_buffered, prefetched['audio'], final_metadata, current_cover_to_use)))
+                        # Premier album validé dans ce dossier: le proposer aux pistes restantes
+                        if final_metadata.get('album') and tracks_left[filepath.parent] and filepath.parent not in album_asked:
+                            album_asked.add(filepath.parent)
+                            if questionary.confirm(f"Appliquer cet album aux {tracks_left[filepath.parent]} autres pistes du dossier ?", default=True).ask():
+                                album_choices[filepath.parent] = {'cover': current_cover_to_use,
+                                    'metadata': {k: final_metadata.get(k, '') for k in ('artist', 'album', 'year', 'release_id')}}
+                    else:
+                         print("  Aucune donnée significative à écrire fournie. Fichier passé.")
+                         skipped_count += 1
+                elif action == "skip": pass # Déjà compté
+                elif action not in ["stop", None] and not final_metadata : # Cas où action = manuel mais rien saisi
+                     print("  Saisie manuelle vide. Fichier passé.")
                      skipped_count += 1
-                     # Nettoyer pochette si associée à une action vide
-                     if current_cover_to_use and os.path.exists(current_cover_to_use):
-                          try: os.remove(current_cover_to_use)
-                          except OSError: pass
-            elif action == "skip": pass # Déjà compté
-            elif action not in ["stop", None] and not final_metadata : # Cas où action = manuel mais rien saisi
-                 print("  Saisie manuelle vide. Fichier passé.")
-                 skipped_count += 1
-
-
-        # Fin de la boucle principale (for filepath in all_files)
-        except KeyboardInterrupt: # Gérer Ctrl+C proprement
-            print("\nArrêt demandé par l'utilisateur (Ctrl+C).")
-            stop_processing = True
-        except Exception as loop_error: # Gérer erreur inattendue sur un fichier
-            print(f"\nERREUR INATTENDUE sur le fichier {filepath.name}: {loop_error}", file=sys.stderr)
-            traceback.print_exc() # Afficher la trace pour le debug
-            error_count += 1
-            # Proposer de continuer ?
-            if not questionary.confirm("Une erreur s'est produite. Continuer avec le fichier suivant ?", default=True).ask():
+
+
+            # Fin de la boucle principale (for filepath in all_files)
+            except KeyboardInterrupt: # Gérer Ctrl+C proprement
+                print("\nArrêt demandé par l'utilisateur (Ctrl+C).")
                 stop_processing = True
+            except Exception as loop_error: # Gérer erreur inattendue sur un fichier
+                print(f"\nERREUR INATTENDUE sur le fichier {filepath.name}: {loop_error}", file=sys.stderr)
+                errors_log.append((filepath.name, repr(loop_error), traceback.format_exc())) # Trace gardée pour le rapport
+                error_count += 1
+                # Proposer de continuer ? (sauf si l'utilisateur a déjà répondu « à tous »)
+                if continue_on_error is None:
+                    answer = questionary.select("Une erreur s'est produite. Continuer avec le fichier suivant ?",
+                                                choices=["Oui", "Oui à tous", "Non", "Non à tous"]).ask()
+                    if answer in ("Oui à tous", "Non à tous"): continue_on_error = answer.startswith("Oui")
+                    if not answer or answer.startswith("Non"): stop_processing = True
+                elif not continue_on_error: stop_processing = True
+    finally:
+        stop_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        lookup_executor.shutdown(wait=False, cancel_futures=True)
+        writer.shutdown(wait=True) # Ne jamais abandonner une écriture en cours
+        sys.stdout, sys.stderr = original_stdout, original_stderr
+        replay_output([]) # Sortie d'arrière-plan encore en attente
+
+    while pending_writes: # Bilan des dernières écritures
+        if finish_write(pending_writes.popleft()): processed_count += 1
+        else: error_count += 1
 
 
     # --- Rapport Final ---
@@ -634,10 +1448,21 @@ def process_music_library(music_dir):
     # Distinguer erreurs et skips ?
     # print(f"Fichiers passés (Skip/Vide) : {skipped_count}")
     # print(f"Erreurs / Non traités (empreinte/API/écriture) : {error_count}")
+    if errors_log:
+        print(f"\nErreurs inattendues ({len(errors_log)} dernière(s)) :", file=sys.stderr)
+        for name, error, _ in errors_log: print(f"  {name}: {error}", file=sys.stderr)
+        print(f"\nTrace de la dernière erreur ({errors_log[-1][0]}) :\n{errors_log[-1][2]}", file=sys.stderr)
 
 
 # --- Point d'entrée du script ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Assistant interactif de métadonnées musicales.")
+    parser.add_argument('--yes', '-y', action='store_true', help="commencer le scan sans demander de confirmation")
+    parser.add_argument('--dir', type=Path, default=MUSIC_DIR, help=f"dossier musical à scanner (défaut: {MUSIC_DIR})")
+    parser.add_argument('--jobs', '-j', type=int, default=FINGERPRINT_CONCURRENCY, help=f"calculs d'empreinte simultanés (défaut: {FINGERPRINT_CONCURRENCY})")
+    args = parser.parse_args()
+    FINGERPRINTER.concurrency = max(1, args.jobs)
+
     if ACOUSTID_API_KEY == 'VOTRE_CLE_API_ACOUSTID' or not ACOUSTID_API_KEY:
         print("ERREUR: Veuillez configurer votre clé API AcoustID (ACOUSTID_API_KEY).", file=sys.stderr)
         sys.exit(1)
@@ -651,9 +1476,9 @@ if __name__ == "__main__":
     print("\n!!! IMPORTANT !!! Faites une SAUVEGARDE de votre musique avant de continuer.")
 
     try:
-        start_scan = questionary.confirm("Êtes-vous prêt à commencer le scan interactif ?", default=False, auto_enter=False).ask()
+        start_scan = args.yes or questionary.confirm("Êtes-vous prêt à commencer le scan interactif ?", default=False, auto_enter=False).ask()
         if start_scan:
-            process_music_library(MUSIC_DIR)
+            process_music_library(args.dir)
         else:
             print("Traitement annulé.")
     except KeyboardInterrupt: